@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activations (
+    work_id TEXT PRIMARY KEY,
+    device_info TEXT,
+    activate_time TEXT,
+    last_verify TEXT,
+    token TEXT,
+    token_expire INTEGER NOT NULL DEFAULT 0,
+    status TEXT,
+    activate_count INTEGER NOT NULL DEFAULT 0,
+    expire_time TEXT
+);
+-- status前缀用于统计激活数，token_expire用于过期清理的范围查找
+CREATE INDEX IF NOT EXISTS idx_activations_status_expire ON activations(status, token_expire);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class ActivationStore:
+    """激活记录存储（SQLite WAL），每次变更为单条语句的原子提交"""
+
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, "activations.db")
+        self.conn = sqlite3.connect(self.path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+        if self.last_updated() is None:
+            self._import_json(os.path.join(data_dir, "activations.json"))
+
+    def close(self):
+        """关闭连接，最后一个连接关闭时SQLite会合并WAL文件"""
+        self.conn.close()
+
+    def _import_json(self, json_path):
+        """首次启用时导入旧的activations.json，导入后改名为.migrated，数据库成为唯一数据源"""
+        activations = {}
+        last_updated = datetime.now().isoformat()
+        if os.path.exists(json_path):
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            activations = data.get("activations", {})
+            last_updated = data.get("last_updated") or last_updated
+
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO activations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(
+                    work_id,
+                    json.dumps(a.get("device_info", {}), ensure_ascii=False),
+                    a.get("activate_time"),
+                    a.get("last_verify"),
+                    json.dumps(a.get("token", {}), ensure_ascii=False),
+                    (a.get("token") or {}).get("expire_time", 0),
+                    a.get("status"),
+                    a.get("activate_count", 0),
+                    a.get("expire_time")
+                ) for work_id, a in activations.items()]
+            )
+            self._set_last_updated(last_updated)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        # 避免数据库丢失后静默导入过期快照
+        if os.path.exists(json_path):
+            os.replace(json_path, json_path + ".migrated")
+
+    def _set_last_updated(self, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_updated', ?)", (value,))
+
+    def last_updated(self):
+        """最后更新时间"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'last_updated'").fetchone()
+        return row[0] if row else None
+
+    def get_status(self, work_id):
+        """查询激活状态，未激活过返回None"""
+        row = self.conn.execute("SELECT status FROM activations WHERE work_id = ?", (work_id,)).fetchone()
+        return row[0] if row else None
+
+    def activate(self, work_id, device_info, token, now_iso):
+        """记录激活，激活次数在原记录基础上累加"""
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute(
+                """INSERT INTO activations
+                       (work_id, device_info, activate_time, last_verify, token, token_expire, status, activate_count)
+                   VALUES (?, ?, ?, ?, ?, ?, 'active', 1)
+                   ON CONFLICT(work_id) DO UPDATE SET
+                       device_info = excluded.device_info,
+                       activate_time = excluded.activate_time,
+                       last_verify = excluded.last_verify,
+                       token = excluded.token,
+                       token_expire = excluded.token_expire,
+                       status = 'active',
+                       activate_count = activate_count + 1,
+                       expire_time = NULL""",
+                (work_id, json.dumps(device_info, ensure_ascii=False), now_iso, now_iso,
+                 json.dumps(token, ensure_ascii=False), token.get("expire_time", 0))
+            )
+            self._set_last_updated(now_iso)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def touch(self, work_id, now_iso):
+        """更新最后验证时间"""
+        self.conn.execute("UPDATE activations SET last_verify = ? WHERE work_id = ?", (now_iso, work_id))
+
+    def active_count(self):
+        """当前激活设备数"""
+        return self.conn.execute("SELECT COUNT(*) FROM activations WHERE status = 'active'").fetchone()[0]
+
+    def expire_tokens(self, current_time, now_iso):
+        """将令牌已过期的激活标记为expired，返回标记数量"""
+        self.conn.execute("BEGIN")
+        try:
+            cleaned_count = self.conn.execute(
+                """UPDATE activations SET status = 'expired', expire_time = ?
+                   WHERE status = 'active' AND token_expire < ?""",
+                (now_iso, current_time)
+            ).rowcount
+            self._set_last_updated(now_iso)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return cleaned_count
@@ -4,21 +4,165 @@ import hmac
 import hashlib
 import time
 import argparse
+import atexit
 from datetime import datetime
 import os
+import queue
+import re
+import secrets
+import signal
+import socket
+import ssl
 import sys
+import tempfile
+import threading
+
+from activation_store import ActivationStore
+
+try:
+    import orjson
+    from orjson import loads as json_loads
+except ImportError:
+    orjson = None
+    from json import loads as json_loads
+
+# 授权码为8位十六进制（不区分大小写），令牌签名为16位小写十六进制
+AUTH_CODE_PATTERN = re.compile(r'[0-9A-Fa-f]{8}')
+SIGNATURE_PATTERN = re.compile(r'[0-9a-f]{16}')
+
+SOCKET_NAME = "auth.sock"
+MAX_FRAME_SIZE = 65536
+# 常驻进程等待单个连接发送请求的时间，避免异常客户端阻塞后续请求
+SERVER_TIMEOUT = 1.0
+# 客户端等待常驻进程响应的时间，超时后在本进程内处理
+CLIENT_TIMEOUT = 3.0
+
+# 新建文件的默认权限（受umask影响），在启动线程前读取
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+def check_sha_ni():
+    """检查CPU与OpenSSL是否启用SHA-NI硬件加速，未启用时输出警告"""
+    if "sha256" not in hashlib.algorithms_available:
+        print(f"警告: {ssl.OPENSSL_VERSION} 未提供sha256", file=sys.stderr)
+        return False
+    
+    try:
+        with open("/proc/cpuinfo", 'r', encoding='utf-8') as f:
+            cpuinfo = f.read()
+    except OSError:
+        return True
+    
+    # x86为flags中的sha_ni，ARM为Features中的sha2
+    has_sha = False
+    for line in cpuinfo.splitlines():
+        if line.startswith(("flags", "Features")):
+            cpu_flags = line.split(":", 1)[-1].split()
+            has_sha = "sha_ni" in cpu_flags or "sha2" in cpu_flags
+            break
+    
+    if not has_sha:
+        print(f"警告: CPU不支持SHA-NI，{ssl.OPENSSL_VERSION} 将使用软件SHA-256", file=sys.stderr)
+        return False
+    
+    # OPENSSL_ia32cap第二段对应CPUID leaf 7 EBX，bit 29为SHA扩展
+    ia32cap = os.environ.get("OPENSSL_ia32cap", "")
+    if ":" in ia32cap:
+        leaf7 = ia32cap.split(":", 1)[1].split(":")[0]
+        try:
+            mask = int(leaf7.lstrip("~"), 0)
+        except ValueError:
+            mask = None
+        if mask is not None and bool(mask & (1 << 29)) == leaf7.startswith("~"):
+            print("警告: OPENSSL_ia32cap屏蔽了SHA-NI", file=sys.stderr)
+            return False
+    
+    return True
+
+def parse_hex(value, pattern):
+    """按格式解析十六进制字符串，格式不符时返回空字节（bytes.fromhex本身会接受空白等宽松写法）"""
+    if not isinstance(value, str) or not pattern.fullmatch(value):
+        return b''
+    return bytes.fromhex(value)
 
 class AuthProcessor:
     def __init__(self, secret_key):
         self.secret_key = secret_key
+        self._secret_bytes = secret_key.encode()
+        # 预先完成密钥填充，每次签名只需复制
+        self._hmac_template = hmac.new(self._secret_bytes, b'', hashlib.sha256)
         self.data_dir = "data"
+        # 数据目录只创建一次，文件路径预先拼接
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._paths = {
+            name: os.path.join(self.data_dir, name)
+            for name in ("config.json", "authorized_workers.json", "latest_result.json")
+        }
+        check_sha_ni()
         self.load_data()
+        
+        # latest_result.json 仅用于调试，由后台线程写入，不阻塞请求
+        self._result_queue = queue.SimpleQueue()
+        self._result_writer = threading.Thread(target=self._write_results, daemon=True)
+        self._result_writer.start()
+        atexit.register(self.close)
+    
+    def close(self):
+        """等待后台写入完成并关闭激活存储"""
+        if self._result_writer.is_alive():
+            self._result_queue.put(None)
+            self._result_writer.join()
+        self.store.close()
+    
+    def _write_results(self):
+        """后台写入结果文件，同一文件只保留最新一份"""
+        while True:
+            pending = {}
+            item = self._result_queue.get()
+            while item is not None:
+                filename, data = item
+                pending[filename] = data
+                try:
+                    item = self._result_queue.get_nowait()
+                except queue.Empty:
+                    break
+            
+            # 单次写入失败只报告，不能让写入线程退出
+            for filename, data in pending.items():
+                try:
+                    self.save_json(filename, data)
+                except Exception as e:
+                    print(f"警告: 写入{filename}失败: {e}", file=sys.stderr)
+            
+            if item is None:
+                return
     
     def load_data(self):
         """加载所有数据文件"""
+        self.store = ActivationStore(self.data_dir)
+        self.load_config()
+    
+    def _config_mtimes(self):
+        mtimes = []
+        for name in ("config.json", "authorized_workers.json"):
+            try:
+                mtimes.append(os.stat(self._paths[name]).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return mtimes
+    
+    def reload_if_changed(self):
+        """配置或工号文件有变化时重新加载，供常驻模式在每个请求前调用"""
+        if self._config_mtimes() != self._config_mtime:
+            self.load_config()
+    
+    def load_config(self):
+        """加载配置与授权工号"""
+        # 先记录修改时间再读取，读取期间的修改会在下次检查时重新加载
+        self._config_mtime = self._config_mtimes()
         self.config = self.load_json("config.json")
         self.workers = self.load_json("authorized_workers.json")
-        self.activations = self.load_json("activations.json")
         
         # 初始化默认数据
         if not self.config:
@@ -48,23 +192,36 @@ class AuthProcessor:
                 }
             }
         
-        if not self.activations:
-            self.activations = {"activations": {}, "last_updated": datetime.now().isoformat()}
+        self._workers = self.workers.get("workers", {})
+        
+        self.token_expire_days = self.config.get("token_expire_days", 30)
+        self.auth_code_valid_minutes = self.config.get("auth_code_valid_minutes", 10)
     
     def load_json(self, filename):
         """加载JSON文件"""
-        path = os.path.join(self.data_dir, filename)
+        path = self._paths.get(filename) or os.path.join(self.data_dir, filename)
         if os.path.exists(path):
             with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                return json_loads(f.read())
         return {}
     
     def save_json(self, filename, data):
         """保存JSON文件"""
-        path = os.path.join(self.data_dir, filename)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        path = self._paths.get(filename) or os.path.join(self.data_dir, filename)
+        # 先写临时文件再原子替换，避免写入中断损坏数据
+        f = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.data_dir, delete=False)
+        try:
+            with f:
+                if orjson is not None:
+                    f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2).decode())
+                else:
+                    json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            # 临时文件默认0600，改为与普通open一致的权限
+            os.chmod(f.name, FILE_MODE)
+            os.replace(f.name, path)
+        except BaseException:
+            os.unlink(f.name)
+            raise
     
     def save_result(self, action, result_data):
         """保存处理结果"""
@@ -73,38 +230,43 @@ class AuthProcessor:
             "timestamp": datetime.now().isoformat(),
             "data": result_data
         }
-        self.save_json("latest_result.json", result)
+        self._result_queue.put(("latest_result.json", result))
+    
+    def _hmac_digest(self, *parts):
+        """基于预计算密钥的HMAC-SHA256，各段依次写入，等价于拼接后签名"""
+        h = self._hmac_template.copy()
+        for part in parts:
+            h.update(part)
+        return h.digest()
     
     def generate_auth_code(self, work_id, timestamp):
-        """生成授权码"""
-        message = f"{work_id}{timestamp}{self.secret_key}"
-        return hmac.new(
-            self.secret_key.encode(),
-            message.encode(),
-            hashlib.sha256
-        ).hexdigest()[:8].upper()
+        """生成授权码（4字节原始摘要，对外显示为8位大写十六进制）"""
+        return self._hmac_digest(
+            str(work_id).encode(),
+            str(timestamp).encode(),
+            self._secret_bytes
+        )[:4]
     
     def generate_token(self, work_id):
         """生成访问令牌"""
-        expire_days = self.config.get("token_expire_days", 30)
-        expire_time = int(time.time()) + expire_days * 24 * 3600
+        now = int(time.time())
+        expire_time = now + self.token_expire_days * 24 * 3600
         
         payload = {
             'work_id': work_id,
             'expire_time': expire_time,
-            'issue_time': int(time.time()),
-            'token_id': hashlib.md5(f"{work_id}{time.time()}".encode()).hexdigest()[:8]
+            'issue_time': now,
+            'token_id': secrets.token_hex(4)
         }
         
         # 生成签名
-        message = f"{work_id}{expire_time}{payload['token_id']}"
-        signature = hmac.new(
-            self.secret_key.encode(),
-            message.encode(),
-            hashlib.sha256
-        ).hexdigest()[:16]
-        
-        payload['signature'] = signature
+        signature = self._hmac_digest(
+            work_id.encode(),
+            str(expire_time).encode(),
+            payload['token_id'].encode()
+        )[:8]
+        
+        payload['signature'] = signature.hex()
         return payload
     
     def verify_token(self, token_data):
@@ -120,28 +282,27 @@ class AuthProcessor:
         expire_time = token_data.get('expire_time')
         token_id = token_data.get('token_id')
         
-        message = f"{work_id}{expire_time}{token_id}"
-        expected_signature = hmac.new(
-            self.secret_key.encode(),
-            message.encode(),
-            hashlib.sha256
-        ).hexdigest()[:16]
+        expected_signature = self._hmac_digest(
+            str(work_id).encode(),
+            str(expire_time).encode(),
+            str(token_id).encode()
+        )[:8]
         
-        if not hmac.compare_digest(token_data.get('signature', ''), expected_signature):
+        if not hmac.compare_digest(parse_hex(token_data.get('signature'), SIGNATURE_PATTERN), expected_signature):
             return False, "令牌签名无效"
         
         return True, "验证成功"
     
     def process_request_auth(self, work_id):
         """处理授权码请求"""
-        if work_id not in self.workers.get("workers", {}):
+        worker_info = self._workers.get(work_id)
+        if worker_info is None:
             return {
                 "success": False,
                 "message": "工号未授权",
                 "error_code": "WORKER_NOT_AUTHORIZED"
             }
         
-        worker_info = self.workers["workers"][work_id]
         if worker_info.get("status") != "active":
             return {
                 "success": False,
@@ -155,10 +316,10 @@ class AuthProcessor:
         result = {
             "success": True,
             "timestamp": timestamp,
-            "auth_code": auth_code,
+            "auth_code": auth_code.hex().upper(),
             "worker_name": worker_info.get("name", ""),
-            "valid_minutes": self.config.get("auth_code_valid_minutes", 10),
-            "message": f"授权码有效期为{self.config.get('auth_code_valid_minutes', 10)}分钟"
+            "valid_minutes": self.auth_code_valid_minutes,
+            "message": f"授权码有效期为{self.auth_code_valid_minutes}分钟"
         }
         
         self.save_result("request_auth", result)
@@ -168,7 +329,7 @@ class AuthProcessor:
         """处理设备激活"""
         # 验证授权码
         expected_code = self.generate_auth_code(work_id, timestamp)
-        if not hmac.compare_digest(auth_code.upper(), expected_code):
+        if not hmac.compare_digest(parse_hex(auth_code, AUTH_CODE_PATTERN), expected_code):
             result = {
                 "success": False,
                 "message": "授权码无效",
@@ -178,7 +339,7 @@ class AuthProcessor:
             return result
         
         # 检查授权码是否过期
-        valid_minutes = self.config.get("auth_code_valid_minutes", 10)
+        valid_minutes = self.auth_code_valid_minutes
         if time.time() - timestamp > valid_minutes * 60:
             result = {
                 "success": False,
@@ -189,38 +350,27 @@ class AuthProcessor:
             return result
         
         # 检查是否已经激活
-        if work_id in self.activations.get("activations", {}):
-            activation = self.activations["activations"][work_id]
-            if activation.get("status") == "active":
-                result = {
-                    "success": False,
-                    "message": "该工号已激活其他设备",
-                    "error_code": "ALREADY_ACTIVATED"
-                }
-                self.save_result("activate", result)
-                return result
+        if self.store.get_status(work_id) == "active":
+            result = {
+                "success": False,
+                "message": "该工号已激活其他设备",
+                "error_code": "ALREADY_ACTIVATED"
+            }
+            self.save_result("activate", result)
+            return result
         
         # 生成令牌
         token = self.generate_token(work_id)
         
         # 记录激活信息
-        self.activations["activations"][work_id] = {
-            "device_info": device_info,
-            "activate_time": datetime.now().isoformat(),
-            "last_verify": datetime.now().isoformat(),
-            "token": token,
-            "status": "active",
-            "activate_count": self.activations["activations"].get(work_id, {}).get("activate_count", 0) + 1
-        }
-        
-        self.activations["last_updated"] = datetime.now().isoformat()
-        self.save_json("activations.json", self.activations)
+        now_iso = datetime.now().isoformat()
+        self.store.activate(work_id, device_info, token, now_iso)
         
         result = {
             "success": True,
             "token": token,
-            "expire_days": self.config.get("token_expire_days", 30),
-            "worker_name": self.workers["workers"][work_id].get("name", ""),
+            "expire_days": self.token_expire_days,
+            "worker_name": self._workers[work_id].get("name", ""),
             "message": "设备激活成功"
         }
         
@@ -243,14 +393,12 @@ class AuthProcessor:
         work_id = token_data.get('work_id')
         
         # 更新最后验证时间
-        if work_id in self.activations.get("activations", {}):
-            self.activations["activations"][work_id]["last_verify"] = datetime.now().isoformat()
-            self.save_json("activations.json", self.activations)
+        self.store.touch(work_id, datetime.now().isoformat())
         
         result = {
             "success": True,
             "work_id": work_id,
-            "worker_name": self.workers["workers"][work_id].get("name", ""),
+            "worker_name": self._workers[work_id].get("name", ""),
             "message": "令牌验证成功"
         }
         
@@ -259,16 +407,13 @@ class AuthProcessor:
     
     def process_status(self):
         """处理状态查询"""
-        active_count = sum(1 for a in self.activations.get("activations", {}).values() 
-                         if a.get("status") == "active")
-        
         result = {
             "success": True,
             "system_status": {
-                "total_authorized": len(self.workers.get("workers", {})),
-                "active_devices": active_count,
+                "total_authorized": len(self._workers),
+                "active_devices": self.store.active_count(),
                 "max_activations": self.config.get("max_activations", 12),
-                "last_updated": self.activations.get("last_updated"),
+                "last_updated": self.store.last_updated(),
                 "version": self.config.get("version", "1.0.0")
             }
         }
@@ -276,42 +421,142 @@ class AuthProcessor:
         self.save_result("status", result)
         return result
 
+def handle_request(processor, request):
+    """按动作分发请求，request字段与命令行参数一致"""
+    action = request.get("action")
+    if action == "request_auth":
+        return processor.process_request_auth(request.get("work_id"))
+    elif action == "activate":
+        device_info = json_loads(request["device_info"]) if request.get("device_info") else {}
+        return processor.process_activate(request.get("work_id"), request.get("auth_code"),
+                                          request.get("timestamp"), device_info)
+    elif action == "verify":
+        token_data = json_loads(request["device_info"]) if request.get("device_info") else {}
+        return processor.process_verify(token_data)
+    elif action == "status":
+        return processor.process_status()
+    return {"success": False, "message": "未知动作"}
+
+def processing_error(e):
+    """构造处理异常结果"""
+    return {
+        "success": False,
+        "message": f"处理错误: {str(e)}",
+        "error_code": "PROCESSING_ERROR"
+    }
+
+def serve(processor):
+    """常驻模式：数据常驻内存，通过Unix socket逐个处理请求"""
+    path = os.path.join(processor.data_dir, SOCKET_NAME)
+    if os.path.exists(path):
+        # 只清理无人监听的残留socket，不抢占正在运行的常驻进程
+        with socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET) as probe:
+            try:
+                probe.connect(path)
+            except ConnectionRefusedError:
+                os.unlink(path)
+            else:
+                print(f"错误: 常驻进程已在运行（{path}）", file=sys.stderr)
+                sys.exit(1)
+    
+    # SIGTERM时正常退出，保证atexit写入未保存的数据
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    server.bind(path)
+    server.listen()
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                conn.settimeout(SERVER_TIMEOUT)
+                try:
+                    request = json_loads(conn.recv(MAX_FRAME_SIZE))
+                    secret = str(request.pop("secret", "")).encode()
+                    if not hmac.compare_digest(secret, processor._secret_bytes):
+                        result = {
+                            "success": False,
+                            "message": "密钥错误",
+                            "error_code": "INVALID_SECRET"
+                        }
+                    else:
+                        processor.reload_if_changed()
+                        result = handle_request(processor, request)
+                except socket.timeout:
+                    continue
+                except Exception as e:
+                    result = processing_error(e)
+                
+                try:
+                    conn.sendall(json.dumps(result, ensure_ascii=False).encode())
+                except OSError:
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(path)
+
+def send_request(path, request):
+    """将请求发送给常驻进程并返回结果，无法连接时返回None"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET) as client:
+        client.settimeout(CLIENT_TIMEOUT)
+        try:
+            client.connect(path)
+        except OSError:
+            return None
+        
+        # 请求发出后常驻进程可能已经执行，不能再在本进程重试
+        try:
+            client.sendall(json.dumps(request, ensure_ascii=False).encode())
+            reply = client.recv(MAX_FRAME_SIZE)
+        except OSError as e:
+            return processing_error(f"常驻进程无响应: {e}")
+        
+        try:
+            return json_loads(reply)
+        except ValueError:
+            return processing_error("常驻进程未返回有效结果")
+
 def main():
     parser = argparse.ArgumentParser(description='GitHub授权处理器')
-    parser.add_argument('--action', required=True)
+    parser.add_argument('--action')
     parser.add_argument('--work_id')
     parser.add_argument('--auth_code')
     parser.add_argument('--timestamp', type=int)
     parser.add_argument('--device_info')
     parser.add_argument('--secret', required=True)
+    parser.add_argument('--serve', action='store_true', help='以常驻进程模式运行')
     
     args = parser.parse_args()
     
+    if args.serve:
+        serve(AuthProcessor(args.secret))
+        return
+    
+    if not args.action:
+        parser.error("the following arguments are required: --action")
+    
+    # 常驻进程存在时交由其处理，无法连接时在本进程内处理
+    request = vars(args)
+    request.pop("serve")
+    sock_path = os.path.join("data", SOCKET_NAME)
+    if os.path.exists(sock_path):
+        result = send_request(sock_path, request)
+        if result is not None:
+            print(json.dumps(result, ensure_ascii=False))
+            if result.get("error_code") == "PROCESSING_ERROR":
+                sys.exit(1)
+            return
+    
     processor = AuthProcessor(args.secret)
     
     try:
-        if args.action == "request_auth":
-            result = processor.process_request_auth(args.work_id)
-        elif args.action == "activate":
-            device_info = json.loads(args.device_info) if args.device_info else {}
-            result = processor.process_activate(args.work_id, args.auth_code, args.timestamp, device_info)
-        elif args.action == "verify":
-            token_data = json.loads(args.device_info) if args.device_info else {}
-            result = processor.process_verify(token_data)
-        elif args.action == "status":
-            result = processor.process_status()
-        else:
-            result = {"success": False, "message": "未知动作"}
-        
+        result = handle_request(processor, request)
         print(json.dumps(result, ensure_ascii=False))
         
     except Exception as e:
-        error_result = {
-            "success": False,
-            "message": f"处理错误: {str(e)}",
-            "error_code": "PROCESSING_ERROR"
-        }
-        print(json.dumps(error_result, ensure_ascii=False))
+        print(json.dumps(processing_error(e), ensure_ascii=False))
         sys.exit(1)
 
 if __name__ == "__main__":